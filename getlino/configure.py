@@ -2,37 +2,41 @@
 # License: BSD (see file COPYING for details)
 
 import os
-import sys
-import stat
-import shutil
 import distro
-import configparser
-import subprocess
 import click
-import collections
 from pathlib import Path
-from contextlib import contextmanager
 
 from os.path import join
 
 from .utils import CONFIG, CONF_FILES, FOUND_CONFIG_FILES, DEFAULTSECTION
 from .utils import KNOWN_REPOS, DB_ENGINES, BATCH_HELP, FRONT_ENDS
-from .utils import Installer, ifroot, default_db_engine, resolve_db_engine
-from .utils import which_certbot
+from .utils import get_installer, ifroot, default_db_engine, resolve_db_engine
+from .utils import which_certbot, config_snapshot, load_config
 from .utils import WEB_SERVERS, resolve_web_server
 
 HEALTHCHECK_NAME = '/usr/local/bin/healthcheck.sh'
 
-CERTBOT_AUTO_RENEW = """\
+def certbot_auto_renew(certbot_cmd):
+    return f"""\
 # generated by getlino
-0 0,12 * * * root python -c 'import random; import time; time.sleep(random.random() * 3600)' && {} renew
+0 0,12 * * * root python -c 'import random; import time; time.sleep(random.random() * 3600)' && {certbot_cmd} renew
 """
 
-MONIT_CONF = """\
+CERTBOT_AUTO = '/usr/local/bin/certbot-auto'
+
+INSTALL_CERTBOT_AUTO = [
+    ['wget', 'https://dl.eff.org/certbot-auto'],
+    ['mv', 'certbot-auto', CERTBOT_AUTO],
+    ['chown', 'root', CERTBOT_AUTO],
+    ['chmod', '0755', CERTBOT_AUTO],
+    [CERTBOT_AUTO, '-n'],
+]
+
+MONIT_CONF = f"""\
 # generated by getlino
-check program status with path {}
+check program status with path {HEALTHCHECK_NAME}
     if status != 0 then alert
-""".format(HEALTHCHECK_NAME)
+"""
 
 LIBREOFFICE_SUPERVISOR_CONF = """\
 # generated by getlino
@@ -41,7 +45,8 @@ command = libreoffice --accept="socket,host=127.0.0.1,port=8100;urp;" --nologo -
 umask = 0002
 """
 
-SHARED_SETTINGS = """\
+def shared_settings(admin_name, admin_email, server_domain, time_zone):
+    return f"""\
 # generated by getlino
 # this is the shared settings file, imported by every Lino site on this server
 ADMINS = [
@@ -60,11 +65,14 @@ alias a='. env/bin/activate'
 alias ll='ls -alF'
 alias pm='python manage.py'
 alias runserver='LINO_LOGLEVEL=DEBUG python manage.py runserver'
-function pywhich() {{
+function pywhich() {
   python -c "import $1; print($1.__file__)"
-}}
+}
 """
-BASH_ALIASES_GO = """
+
+
+def bash_aliases_go(go_bases):
+    return f"""
 function go() {{
     for BASE in {go_bases}
     do
@@ -104,6 +112,7 @@ def add(spec, default, help, type=None, root_only=False):
     o = click.Option([spec], **kwargs)
     o.root_only = root_only
     o.default = DEFAULTSECTION.get(o.name, default)  # ~/.getlino.conf
+    o.question = f"- {o.name} ({help})"  # used when asking interactively
     CONFIGURE_OPTIONS.append(o)
 
 
@@ -122,46 +131,56 @@ def default_shared_env():
 #     #return ''
 
 
-# must be same order as in signature of configure command below
-# add('--prod/--no-prod', True, "Whether this is a production server")
-add('--sites-base', default_sites_base, 'Base directory for Lino sites on this server')
-add('--local-prefix', 'lino_local', "Prefix for local server-wide importable packages")
-add('--shared-env', default_shared_env, "Root directory of your shared virtualenv")
-add('--repos-base', '', "Base directory for shared code repositories")
-# add('--repos-base', default_repos_base, "Base directory for shared code repositories")
-add('--clone/--no-clone', False, "Clone all contributor repositories and install them to the shared-env")
-add('--branch', 'master', "The git branch to use for --clone")
-add('--webdav/--no-webdav', True, "Whether to enable webdav on new sites", root_only=True)
-add('--backups-base', '/var/backups/lino', 'Base directory for backups', root_only=True)
-add('--log-base', '/var/log/lino', 'Base directory for log files', root_only=True)
-add('--usergroup', 'www-data', "User group for files to be shared with the web server", root_only=True)
-add('--supervisor-dir', '/etc/supervisor/conf.d', "Directory for supervisor config files", root_only=True)
-add('--env-link', 'env', "link to virtualenv (relative to project dir)")
-add('--repos-link', 'repositories', "link to code repositories (relative to virtualenv)")
-add('--appy/--no-appy', ifroot, "Whether this server provides appypod and LibreOffice", root_only=True)
-add('--redis/--no-redis', ifroot, "Whether this server provides redis")
-add('--devtools/--no-devtools', lambda: not ifroot(),
-    "Whether to install development tools (build docs and run tests)")
-add('--server-domain', 'localhost', "Domain name of this server")
-add('--https/--no-https', False, "Whether this server uses secure http", root_only=True)
-add('--ldap/--no-ldap', False, "Whether this server works as an LDAP server", root_only=True)
-add('--monit/--no-monit', True, "Whether this server uses monit", root_only=True)
-add('--web-server', '', "Which web server to use here.",
-    click.Choice([e.name for e in WEB_SERVERS]), root_only=True)
-add('--db-engine', default_db_engine, "Default database engine for new sites.",
-    click.Choice([e.name for e in DB_ENGINES]))
-add('--db-port', '', "Default database port to use for new sites.")
-add('--db-host', 'localhost', "Default database host name for new sites.")
-add('--db-user', '', "Default database user name for new sites. Leave empty to use the project name.")
-add('--db-password', '', "Default database password for new sites. Leave empty to generate a secure password.")
-add('--admin-name', 'Joe Dow', "The full name of the server administrator")
-add('--admin-email', 'joe@example.com',
-    "The email address of the server administrator")
-add('--time-zone', 'Europe/Brussels', "The TIME_ZONE to set on new sites")
-add('--linod/--no-linod', True, "Whether new sites use linod", root_only=True)
-add('--languages', 'en', "The languages to set on new sites")
-add('--front-end', 'lino.modlib.extjs', "The front end to use on new sites",
-    click.Choice([r.front_end for r in FRONT_ENDS]))
+def configure_options():
+    """Return the list of options of the configure command.
+
+    The options are built when they are needed for the first time, so that
+    other getlino commands don't need to build them.
+    """
+    if len(CONFIGURE_OPTIONS) == 0:
+        load_config()
+        # must be same order as in signature of configure command below
+        # add('--prod/--no-prod', True, "Whether this is a production server")
+        add('--sites-base', default_sites_base, 'Base directory for Lino sites on this server')
+        add('--local-prefix', 'lino_local', "Prefix for local server-wide importable packages")
+        add('--shared-env', default_shared_env, "Root directory of your shared virtualenv")
+        add('--repos-base', '', "Base directory for shared code repositories")
+        # add('--repos-base', default_repos_base, "Base directory for shared code repositories")
+        add('--clone/--no-clone', False, "Clone all contributor repositories and install them to the shared-env")
+        add('--branch', 'master', "The git branch to use for --clone")
+        add('--webdav/--no-webdav', True, "Whether to enable webdav on new sites", root_only=True)
+        add('--backups-base', '/var/backups/lino', 'Base directory for backups', root_only=True)
+        add('--log-base', '/var/log/lino', 'Base directory for log files', root_only=True)
+        add('--usergroup', 'www-data', "User group for files to be shared with the web server", root_only=True)
+        add('--supervisor-dir', '/etc/supervisor/conf.d', "Directory for supervisor config files", root_only=True)
+        add('--env-link', 'env', "link to virtualenv (relative to project dir)")
+        add('--repos-link', 'repositories', "link to code repositories (relative to virtualenv)")
+        add('--appy/--no-appy', ifroot, "Whether this server provides appypod and LibreOffice", root_only=True)
+        add('--redis/--no-redis', ifroot, "Whether this server provides redis")
+        add('--devtools/--no-devtools', lambda: not ifroot(),
+            "Whether to install development tools (build docs and run tests)")
+        add('--server-domain', 'localhost', "Domain name of this server")
+        add('--https/--no-https', False, "Whether this server uses secure http", root_only=True)
+        add('--ldap/--no-ldap', False, "Whether this server works as an LDAP server", root_only=True)
+        add('--monit/--no-monit', True, "Whether this server uses monit", root_only=True)
+        add('--web-server', '', "Which web server to use here.",
+            click.Choice([e.name for e in WEB_SERVERS]), root_only=True)
+        add('--db-engine', default_db_engine, "Default database engine for new sites.",
+            click.Choice([e.name for e in DB_ENGINES]))
+        add('--db-port', '', "Default database port to use for new sites.")
+        add('--db-host', 'localhost', "Default database host name for new sites.")
+        add('--db-user', '', "Default database user name for new sites. Leave empty to use the project name.")
+        add('--db-password', '', "Default database password for new sites. Leave empty to generate a secure password.")
+        add('--admin-name', 'Joe Dow', "The full name of the server administrator")
+        add('--admin-email', 'joe@example.com',
+            "The email address of the server administrator")
+        add('--time-zone', 'Europe/Brussels', "The TIME_ZONE to set on new sites")
+        add('--linod/--no-linod', True, "Whether new sites use linod", root_only=True)
+        add('--languages', 'en', "The languages to set on new sites")
+        add('--front-end', 'lino.modlib.extjs', "The front end to use on new sites",
+            click.Choice([r.front_end for r in FRONT_ENDS]))
+
+    return CONFIGURE_OPTIONS
 
 
 def configure(ctx, batch,
@@ -183,9 +202,8 @@ def configure(ctx, batch,
     #     raise click.UsageError("Found multiple config files: {}".format(
     #         FOUND_CONFIG_FILES))
 
-    i = Installer(batch)
+    i = get_installer(batch)
     context = {}
-    context.update(DEFAULTSECTION)
     context.update({
         "prjname": '',
         "appname": '',
@@ -204,8 +222,7 @@ def configure(ctx, batch,
 
     # before asking questions check whether we will be able to store them
     pth = os.path.dirname(conffile)
-    if not os.path.exists(pth):
-        os.makedirs(pth, exist_ok=True)
+    os.makedirs(pth, exist_ok=True)
     if not os.access(pth, os.W_OK):
         raise click.ClickException(
             "No write permission for directory {}".format(pth))
@@ -217,26 +234,36 @@ def configure(ctx, batch,
     # if shared_env: not sure whether this is a good idea
     #     shared_env = os.path.abspath(shared_env)
 
-    for p in CONFIGURE_OPTIONS:
+    values = dict(
+        sites_base=sites_base, local_prefix=local_prefix,
+        shared_env=shared_env, repos_base=repos_base, clone=clone,
+        branch=branch, webdav=webdav, backups_base=backups_base,
+        log_base=log_base, usergroup=usergroup, supervisor_dir=supervisor_dir,
+        env_link=env_link, repos_link=repos_link, appy=appy, redis=redis,
+        devtools=devtools, server_domain=server_domain, https=https,
+        ldap=ldap, monit=monit, db_engine=db_engine, db_port=db_port,
+        db_host=db_host, db_user=db_user, db_password=db_password,
+        admin_name=admin_name, admin_email=admin_email, time_zone=time_zone,
+        linod=linod, languages=languages, front_end=front_end,
+        web_server=web_server)
+    for p in configure_options():
         k = p.name
-        v = locals()[k]
+        v = values[k]
         if batch:
             CONFIG.set(CONFIG.default_section, k, str(v))
         elif p.root_only and not ifroot():
             continue
         else:
-            msg = "- {} ({})".format(k, p.help)
-            kwargs = dict(default=v)
-            if p.type is not None:
-                kwargs.update(type=p.type)
-            answer = click.prompt(msg, **kwargs)
+            answer = click.prompt(p.question, default=v, type=p.type)
             if type(answer) == type("string"):
                 answer = answer.rstrip("/")
             # conf_values[k] = answer
             CONFIG.set(CONFIG.default_section, k, str(answer))
 
-    db_engine = resolve_db_engine(DEFAULTSECTION.get('db_engine'))
-    web_server = resolve_web_server(DEFAULTSECTION.get('web_server'))
+    cfg = i.cfg = config_snapshot()
+    context.update(vars(cfg))
+    db_engine = resolve_db_engine(cfg.db_engine)
+    web_server = resolve_web_server(cfg.web_server)
 
     if db_user and not db_password:
         raise click.Error("If you set a shared --db-user you must also set a shared --db-password")
@@ -251,7 +278,7 @@ def configure(ctx, batch,
     # click.echo("20200727 os.geteuid() is {}".format(os.geteuid()))
     if ifroot():
         # click.echo("20200727 You are root...")
-        if DEFAULTSECTION.getboolean('monit'):
+        if cfg.monit:
             # click.echo("20200727 Install monit...")
             # Debian buster didn't include monit for administrative reasons,
             # so we must add a backport.
@@ -271,9 +298,7 @@ def configure(ctx, batch,
                         # i.runcmd('printf "%s\\n" "deb http://ftp.de.debian.org/debian buster-backports main" | sudo tee /etc/apt/sources.list.d/buster-backports.list')
                         # i.runcmd('echo "deb http://ftp.de.debian.org/debian buster-backports main" >> /etc/apt/sources.list.d/buster-backports.list')
         if batch or i.yes_or_no("Upgrade the system?", default=True):
-            with i.override_batch(True):
-                i.runcmd("apt-get update -y")
-                i.runcmd("apt-get upgrade -y")
+            i.apt_upgrade()
 
     i.apt_install(
         "git subversion python3 python3-dev python3-setuptools python3-pip supervisor")
@@ -290,13 +315,13 @@ def configure(ctx, batch,
         i.apt_install("logrotate")
         i.must_restart(web_server.service)
 
-    if DEFAULTSECTION.getboolean('devtools'):
+    if cfg.devtools:
         i.apt_install("graphviz sqlite3")
 
-    if DEFAULTSECTION.getboolean('monit'):
+    if cfg.monit:
         i.apt_install("monit")
 
-    if DEFAULTSECTION.getboolean('redis'):
+    if cfg.redis:
         i.apt_install("redis-server")
 
     i.apt_install(db_engine.apt_packages)
@@ -309,24 +334,20 @@ def configure(ctx, batch,
     if db_user:
         db_engine.setup_user(i, context)
 
-    if DEFAULTSECTION.getboolean('appy'):
+    if cfg.appy:
         i.apt_install("libreoffice python3-uno")
         i.apt_install("tidy")
 
-    if DEFAULTSECTION.getboolean('ldap'):
+    if cfg.ldap:
         i.apt_install("slapd ldap-utils")
 
     if ifroot():
         for k in ("log_base", "backups_base"):
-            pth = DEFAULTSECTION.get(k)
+            pth = getattr(cfg, k)
             if not pth:
                 print("Strange: {} is empty...".format(k))
                 continue
-            if not os.path.exists(pth):
-                if batch or i.yes_or_no(
-                        "Create {} {} ?".format(k, pth), default=True):
-                    os.makedirs(pth, exist_ok=True)
-            i.check_permissions(pth)
+            i.ensure_dir(pth, "Create " + k + " {} ?")
         i.apt_install("zip")
 
     i.run_apt_install()
@@ -339,60 +360,39 @@ def configure(ctx, batch,
         if not shared_env:
             raise click.ClickException("Cannot --clone without --shared-env")
 
-        repos_base = DEFAULTSECTION.get('repos_base')
+        repos_base = cfg.repos_base
         if not repos_base:
-            repos_base = join(shared_env, DEFAULTSECTION.get('repos_link'))
+            repos_base = join(shared_env, cfg.repos_link)
 
-        if not os.path.exists(repos_base):
-            if batch or i.yes_or_no(
-                    "Create base directory for repositories {} ?".format(repos_base),
-                    default=True):
-                os.makedirs(repos_base, exist_ok=True)
-        i.check_permissions(repos_base)
+        i.ensure_dir(repos_base, "Create base directory for repositories {} ?")
 
         i.check_virtualenv(shared_env, context)
-        os.chdir(repos_base)
         repos = [r for r in KNOWN_REPOS if r.git_repo]
         if batch or i.yes_or_no("Clone repositories to {} ?".format(repos_base), default=True):
             with i.override_batch(True):
-                for repo in repos:
-                    i.clone_repo(repo)
+                i.clone_repos(repos, repos_base)
         if batch or i.yes_or_no("Install cloned repositories to {} ?".format(shared_env), default=True):
             with i.override_batch(True):
-                for repo in repos:
-                    i.install_repo(repo, shared_env)
+                i.install_repos(repos, shared_env, repos_base)
         go_bases.append(repos_base)
 
-    pth = DEFAULTSECTION.get('sites_base')
-    if not os.path.exists(pth):
-        if batch or i.yes_or_no("Create base directory for sites {} ?".format(pth), default=True):
-            os.makedirs(pth, exist_ok=True)
-    i.check_permissions(pth)
-
-    local_prefix = DEFAULTSECTION.get('local_prefix')
-    pth = join(DEFAULTSECTION.get('sites_base'), local_prefix)
-    if os.path.exists(pth):
-        i.check_permissions(pth)
-    elif batch or i.yes_or_no("Create shared settings package {} ?".format(pth), default=True):
-        os.makedirs(pth, exist_ok=True)
-        i.check_permissions(pth)
-    with i.override_batch(True):
-        i.check_permissions(pth)
-        i.write_file(join(pth, '__init__.py'), '')
-    i.write_file(join(pth, 'settings.py'),
-                 SHARED_SETTINGS.format(**DEFAULTSECTION))
+    i.ensure_dir(cfg.sites_base, "Create base directory for sites {} ?")
+
+    local_prefix = cfg.local_prefix
+    pth = join(cfg.sites_base, local_prefix)
+    i.ensure_dir(pth, "Create shared settings package {} ?")
+    i.write_file(join(pth, '__init__.py'), '', force=True)
+    i.write_file(join(pth, 'settings.py'), shared_settings(
+        cfg.admin_name, cfg.admin_email, cfg.server_domain, cfg.time_zone))
     go_bases.append(pth)
 
     pth = ifroot('/etc/getlino/lino_bash_aliases', os.path.expanduser('~/.lino_bash_aliases'))
-    ctx = dict(DEFAULTSECTION)
-    content = BASH_ALIASES.format(**ctx)
+    content = BASH_ALIASES
     if len(go_bases):
-        ctx.update(go_bases=" ".join(go_bases))
-        content += BASH_ALIASES_GO.format(**ctx)
-    if DEFAULTSECTION.getboolean('devtools'):
+        content += bash_aliases_go(" ".join(go_bases))
+    if cfg.devtools:
         content += BASH_ALIASES_DEV
     i.write_file(pth, content)
-    i.check_permissions(pth)
     click.echo("Note: please add manually the following line to your .bashrc file:\nsource {}".format(pth))
 
     if ifroot():
@@ -400,28 +400,28 @@ def configure(ctx, batch,
             'supervisor.conf', '/var/log/supervisor/supervisord.log')
         i.must_restart('supervisor')
 
-        if DEFAULTSECTION.getboolean('monit'):
+        if cfg.monit:
             i.jinja_write(HEALTHCHECK_NAME, **context)
-            i.check_permissions(pth, executable=True)
+            i.check_permissions(HEALTHCHECK_NAME, executable=True)
             i.write_file('/etc/monit/conf.d/lino.conf', MONIT_CONF)
             # seems that monit creates its own logrotate config file
             # i.write_logrotate_conf(
             #     'monit.conf', '/var/log/monit.log')
 
-        if DEFAULTSECTION.getboolean('appy'):
+        if cfg.appy:
             i.write_supervisor_conf(
                 'libreoffice.conf',
-                LIBREOFFICE_SUPERVISOR_CONF.format(**DEFAULTSECTION))
+                LIBREOFFICE_SUPERVISOR_CONF)
             i.must_restart('supervisor')
 
         # if DEFAULTSECTION.get('db_engine') == 'mysql':
         #     i.runcmd("mysql_secure_installation")
         # not tested because it interactively asks for root password
 
-        if DEFAULTSECTION.getboolean('https'):
+        if cfg.https:
             certbot_cmd = which_certbot()
             if certbot_cmd:
-                click.echo("{} already installed".format(x))
+                click.echo("{} already installed".format(certbot_cmd))
             if certbot_cmd is None:
                 if batch or i.yes_or_no("Install certbot?", default=True):
                     i.apt_install("certbot python-certbot-nginx")
@@ -430,28 +430,35 @@ def configure(ctx, batch,
             if certbot_cmd is None:
                 if batch or i.yes_or_no("Install certbot-auto?", default=True):
                     with i.override_batch(True):
-                        i.runcmd("wget https://dl.eff.org/certbot-auto")
-                        i.runcmd("mv certbot-auto /usr/local/bin/certbot-auto")
-                        i.runcmd("chown root /usr/local/bin/certbot-auto")
-                        i.runcmd("chmod 0755 /usr/local/bin/certbot-auto")
-                        i.runcmd("certbot-auto -n")
-                        i.runcmd("certbot-auto register --agree-tos -m {} -n".format(DEFAULTSECTION.get('admin_email')))
-                    certbot_cmd = "/usr/local/bin/certbot-auto"
+                        for argv in INSTALL_CERTBOT_AUTO:
+                            i.runcmd(argv)
+                        i.runcmd([CERTBOT_AUTO, 'register', '--agree-tos',
+                                  '-m', cfg.admin_email, '-n'])
+                    certbot_cmd = CERTBOT_AUTO
 
             if batch or i.yes_or_no("Set up automatic certificate renewal?", default=True):
-                i.write_file('/etc/cron.d/getlino-certbot.conf', CERTBOT_AUTO_RENEW.format(certbot_cmd))
+                i.write_file('/etc/cron.d/getlino-certbot.conf', certbot_auto_renew(certbot_cmd))
 
-        if DEFAULTSECTION.getboolean('ldap'):
-            i.runcmd("dpkg-reconfigure slapd")
+        if cfg.ldap:
+            i.runcmd(['dpkg-reconfigure', 'slapd'])
 
     i.restart_services()
 
     click.echo("getlino configure completed.")
 
 
-params = [
-             click.Option(['--batch/--no-batch'], default=False, help=BATCH_HELP),
-         ] + CONFIGURE_OPTIONS
+class ConfigureCommand(click.Command):
+    """A click command whose options are built only when click asks for them.
+    """
+
+    def get_params(self, ctx):
+        if len(self.params) == 0:
+            self.params = [
+                click.Option(['--batch/--no-batch'], default=False, help=BATCH_HELP),
+            ] + configure_options()
+        return super(ConfigureCommand, self).get_params(ctx)
+
+
 configure = click.pass_context(configure)
-configure = click.Command('configure', callback=configure,
-                          params=params, help=configure.__doc__)
+configure = ConfigureCommand('configure', callback=configure,
+                             help=configure.__doc__)
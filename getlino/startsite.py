@@ -2,43 +2,51 @@
 # License: BSD (see file COPYING for details)
 
 import os
+import shlex
 import shutil
 import secrets
 import click
+from string import Template
 
 from os.path import join
 
 from .utils import APPNAMES, FOUND_CONFIG_FILES, DEFAULTSECTION
 from .utils import DB_ENGINES, BATCH_HELP, REPOS_DICT, KNOWN_REPOS
-from .utils import Installer, ifroot, default_db_engine, resolve_db_engine
-from .utils import which_certbot, resolve_web_server
+from .utils import get_installer, ifroot, default_db_engine, resolve_db_engine
+from .utils import which_certbot, resolve_web_server, load_config
 
 COOKIECUTTER_URL = "https://github.com/lino-framework/cookiecutter-startsite"
 
-UWSGI_SUPERVISOR_CONF = """\
+UWSGI_SUPERVISOR_CONF = Template("""\
 # generated by getlino
-[program:{prjname}-uwsgi]
-command = /usr/bin/uwsgi --ini {project_dir}/nginx/uwsgi.ini --ignore-sigpipe
-user = {usergroup}
+[program:${prjname}-uwsgi]
+command = /usr/bin/uwsgi --ini ${project_dir}/nginx/uwsgi.ini --ignore-sigpipe
+user = ${usergroup}
 umask = 0002
 stopsignal = QUIT
-"""
+""")
 
-LINOD_SUPERVISOR_CONF = """\
+LINOD_SUPERVISOR_CONF = Template("""\
 # generated by getlino
-[program:linod-{prjname}]
-command={project_dir}/linod.sh
-user = {usergroup}
+[program:linod-${prjname}]
+command=${project_dir}/linod.sh
+user = ${usergroup}
 umask = 0002
-"""
-LINOD_SH = """\
+""")
+
+
+def linod_sh(project_dir, env_link):
+    return f"""\
 #!/bin/bash
 set -e  # exit on error
 PRJ={project_dir}
 . $PRJ/{env_link}/bin/activate
 exec python $PRJ/manage.py linod
 """
-MAKE_SNAPSHOT_CRON_SH = """\
+
+
+def make_snapshot_cron_sh(project_dir):
+    return f"""\
 #!/bin/sh
 # generated by getlino
 sudo service supervisor stop
@@ -48,6 +56,7 @@ sudo service supervisor start
 
 
 def default_shared_env():
+    load_config()
     return DEFAULTSECTION.get('shared_env')
 
 
@@ -87,38 +96,39 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env,
     #     raise click.UsageError(
     #         "This server is not yet configured. Did you run `sudo -H getlino configure`?")
 
-    i = Installer(batch)
+    i = get_installer(batch)
+    cfg = i.cfg
 
     # if os.path.exists(prjpath):
     #     raise click.UsageError("Project directory {} already exists.".format(prjpath))
 
-    web_server = resolve_web_server(DEFAULTSECTION.get('web_server'))
+    web_server = resolve_web_server(cfg.web_server)
     # prod = DEFAULTSECTION.getboolean('prod')
     # contrib = DEFAULTSECTION.getboolean('contrib')
-    sites_base = DEFAULTSECTION.get('sites_base')
-    local_prefix = DEFAULTSECTION.get('local_prefix')
+    sites_base = cfg.sites_base
+    local_prefix = cfg.local_prefix
     python_path_root = join(sites_base, local_prefix)
     project_dir = join(python_path_root, prjname)
     # shared_env = DEFAULTSECTION.get('shared_env')
-    admin_name = DEFAULTSECTION.get('admin_name')
-    admin_email = DEFAULTSECTION.get('admin_email')
-    server_domain = DEFAULTSECTION.get('server_domain')
+    admin_name = cfg.admin_name
+    admin_email = cfg.admin_email
+    server_domain = cfg.server_domain
     if ifroot() and web_server:
         server_domain = prjname + "." + server_domain
-    server_url = ("https://" if DEFAULTSECTION.getboolean('https') else "http://") \
+    server_url = ("https://" if cfg.https else "http://") \
                  + server_domain
     secret_key = secrets.token_urlsafe(20)
 
-    db_engine = resolve_db_engine(db_engine or DEFAULTSECTION.get('db_engine'))
+    db_engine = resolve_db_engine(db_engine or cfg.db_engine)
 
     if db_engine.needs_root and not ifroot():
         raise click.ClickException(
             "You need to be root for doing startsite with {}".format(db_engine))
 
-    db_host = db_host or DEFAULTSECTION.get('db_host')
-    db_port = db_port or DEFAULTSECTION.get('db_port') or db_engine.default_port
+    db_host = db_host or cfg.db_host
+    db_port = db_port or cfg.db_port or db_engine.default_port
 
-    usergroup = DEFAULTSECTION.get('usergroup')
+    usergroup = cfg.usergroup
 
     app = REPOS_DICT.get(appname, None)
     if app is None:
@@ -126,7 +136,7 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env,
     if not app.settings_module:
         raise click.ClickException("{} is a library, not an application".format(appname))
 
-    front_end = REPOS_DICT.get(DEFAULTSECTION.get('front_end'), None)
+    front_end = REPOS_DICT.get(cfg.front_end, None)
     if front_end is None:
         raise click.ClickException("Invalid front_end name '{}''".format(front_end))
 
@@ -151,10 +161,10 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env,
 
     app_package = app.package_name
     # app_package = app.settings_module.split('.')[0]
-    repo_nickname = app.git_repo.split('/')[-1]
+    repo_nickname = app.repo_nickname
 
     context = {}
-    context.update(DEFAULTSECTION)
+    context.update(vars(cfg))
     pip_packages = set()
     if True:  # not shared_env:
         if app.nickname not in dev_repos:
@@ -191,10 +201,10 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env,
         'Create a new Lino {appname} site into {project_dir}'.format(
             **context))
 
-    db_user = DEFAULTSECTION.get('db_user')
+    db_user = cfg.db_user
     shared_user = False
     if db_user:
-        db_password = DEFAULTSECTION.get('db_password')
+        db_password = cfg.db_password
         shared_user = True
     else:
         db_user = prjname
@@ -246,48 +256,47 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env,
                 i.jinja_write(join(pth, "uwsgi.ini"), **context)
                 i.jinja_write(join(pth, "uwsgi_params"), **context)
 
-        logdir = join(DEFAULTSECTION.get("log_base"), prjname)
-        os.makedirs(logdir, exist_ok=True)
+        logdir = join(cfg.log_base, prjname)
         with i.override_batch(True):
-            i.check_permissions(logdir)
+            i.ensure_dir(logdir)
             os.symlink(logdir, join(project_dir, 'log'))
             i.write_logrotate_conf(
                 'lino-{}.conf'.format(prjname),
                 join(logdir, "lino.log"))
 
-        backups_base_dir = join(DEFAULTSECTION.get("backups_base"), prjname)
-        os.makedirs(backups_base_dir, exist_ok=True)
+        backups_base_dir = join(cfg.backups_base, prjname)
         with i.override_batch(True):
-            i.check_permissions(backups_base_dir)
+            i.ensure_dir(backups_base_dir)
 
-        fn = 'make_snapshot_{prjname}.sh'.format(**context)
-        i.write_daily_cron_job(fn, MAKE_SNAPSHOT_CRON_SH.format(**context))
+        fn = f'make_snapshot_{prjname}.sh'
+        i.write_daily_cron_job(fn, make_snapshot_cron_sh(project_dir))
 
-    if DEFAULTSECTION.getboolean('linod'):
+    if cfg.linod:
         i.write_file(
             join(project_dir, 'linod.sh'),
-            LINOD_SH.format(**context), executable=True)
+            linod_sh(project_dir, cfg.env_link), executable=True)
         if ifroot():
             i.write_supervisor_conf(
                 'linod_{}.conf'.format(prjname),
-                LINOD_SUPERVISOR_CONF.format(**context))
+                LINOD_SUPERVISOR_CONF.substitute(context))
             i.must_restart('supervisor')
 
     os.makedirs(join(project_dir, 'media'), exist_ok=True)
 
     if shared_env:
         envdir = shared_env
+        i.check_virtualenv(envdir, context)
     else:
-        envdir = join(project_dir, DEFAULTSECTION.get('env_link'))
-
-    i.check_virtualenv(envdir, context)
+        # every site has its own virtualenv, they share the seed packages
+        envdir = join(project_dir, cfg.env_link)
+        i.check_virtualenv(envdir, context, join(sites_base, '.virtualenv'))
 
     if shared_env:
-        os.symlink(envdir, join(project_dir, DEFAULTSECTION.get('env_link')))
+        os.symlink(envdir, join(project_dir, cfg.env_link))
         static_root = join(shared_env, 'static_root')
-        if not os.path.exists(static_root):
-            os.makedirs(static_root, exist_ok=True)
+        os.makedirs(static_root, exist_ok=True)
 
+    pip_args = []
     if dev_repos:
         click.echo("dev_repos is {} --> {}".format(dev_repos, dev_repos.split()))
         repos = []
@@ -298,21 +307,19 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env,
             repos.append(lib)
 
         click.echo("Installing {} repositories...".format(len(repos)))
-        full_repos_dir = DEFAULTSECTION.get('repos_base')
+        full_repos_dir = cfg.repos_base
         if not full_repos_dir:
-            full_repos_dir = join(envdir, DEFAULTSECTION.get('repos_link'))
-            if not os.path.exists(full_repos_dir):
-                os.makedirs(full_repos_dir, exist_ok=True)
-        i.check_permissions(full_repos_dir)
-        os.chdir(full_repos_dir)
-        for lib in repos:
-            i.clone_repo(lib)
-        for lib in repos:
-            i.install_repo(lib, envdir)
-
-    if len(pip_packages):
-        click.echo("Installing {} Python packages...".format(len(pip_packages)))
-        i.run_in_env(envdir, "pip install -q --upgrade {}".format(' '.join(pip_packages)))
+            full_repos_dir = join(envdir, cfg.repos_link)
+        i.ensure_dir(full_repos_dir)
+        i.clone_repos(repos, full_repos_dir)
+        pip_args += ["-e " + shlex.quote(join(full_repos_dir, lib.nickname))
+                     for lib in repos]
+
+    # install the cloned repositories and the pip packages in a single pip call
+    pip_args += pip_packages
+    if len(pip_args):
+        click.echo("Installing {} Python packages...".format(len(pip_args)))
+        i.run_in_env(envdir, "pip install -q --upgrade {}".format(' '.join(pip_args)))
 
     if ifroot():
         if web_server:
@@ -328,20 +335,21 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env,
                         os.symlink(avpth, enpth)
             if web_server.name == "nginx":
                 i.write_supervisor_conf('{}-uwsgi.conf'.format(prjname),
-                     UWSGI_SUPERVISOR_CONF.format(**context))
+                     UWSGI_SUPERVISOR_CONF.substitute(context))
                 i.must_restart("supervisor")
             i.must_restart(web_server.service)
 
-    os.chdir(project_dir)
-    i.run_in_env(envdir, "python manage.py install --noinput")
+    i.run_in_env(envdir, "python manage.py install --noinput", cwd=project_dir)
     if not shared_user:
         db_engine.setup_user(i, context)
     db_engine.setup_database(i, prjname, db_user, db_host)
-    i.run_in_env(envdir, "python manage.py migrate --noinput")
-    i.run_in_env(envdir, "python manage.py prep --noinput")
+    i.run_in_env(envdir, "python manage.py migrate --noinput", cwd=project_dir)
+    i.run_in_env(envdir, "python manage.py prep --noinput", cwd=project_dir)
     db_engine.after_prep(i, context)
     if ifroot():
-        i.run_in_env(envdir, "python manage.py collectstatic --noinput")
+        i.run_in_env(envdir, "python manage.py collectstatic --noinput", cwd=project_dir)
+        # files generated as root must be accessible to the web server
+        i.check_permissions_tree(project_dir, exclude=[cfg.env_link])
 
     i.run_apt_install()
     i.restart_services()
@@ -352,12 +360,11 @@ def startsite(ctx, appname, prjname, batch, dev_repos, shared_env,
         # its entries to the default because it does does not yet see the
         # new site.
 
-        if DEFAULTSECTION.getboolean('https'):
+        if cfg.https:
             certbot_cmd = which_certbot()
             if certbot_cmd is None:
                 raise click.ClickException("Oops, certbot is not installed.")
-            i.runcmd("{} --{} -d {}".format(
-                certbot_cmd, web_server.name, server_domain))
+            i.runcmd([certbot_cmd, '--' + web_server.name, '-d', server_domain])
             i.must_restart(web_server.service)
 
     click.echo("The new site {} has been created.".format(prjname))
@@ -5,7 +5,9 @@
 """
 
 import os
-from os.path import expanduser
+import sys
+import re
+from os.path import expanduser, join
 from pathlib import Path
 import stat
 import shutil
@@ -13,19 +15,50 @@ try:
     import grp
 except ImportError:
     grp = None  # e.g. on Windows
-import configparser
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None  # e.g. on Windows
+import select
+import shlex
 import subprocess
+import time
 import click
 # import platform
 import distro
 import collections
 import getpass
-from contextlib import contextmanager
-import virtualenv
-from jinja2 import Environment, PackageLoader
+import functools
+from types import SimpleNamespace, MappingProxyType
+from contextlib import contextmanager, closing
+from concurrent.futures import ThreadPoolExecutor
+from jinja2 import Environment, PackageLoader, FileSystemBytecodeCache
 from .setup_info import SETUP_INFO
 
-JINJA_ENV = Environment(loader=PackageLoader('getlino', 'templates'))
+CACHE_DIR = join(os.environ.get('XDG_CACHE_HOME', expanduser('~/.cache')),
+                 'getlino')
+
+
+@functools.lru_cache(maxsize=None)
+def jinja_env():
+    """Return the Jinja environment used by :meth:`Installer.jinja_write`.
+
+    It is created on first use.  The templates don't change while getlino is
+    running, and their compiled code is kept in :file:`~/.cache/getlino/jinja`
+    between runs, unless that directory isn't ours (e.g. under sudo without
+    -H) or can't be created.
+    """
+    cache = None
+    pth = join(CACHE_DIR, 'jinja')
+    if _owned_by_us(pth):
+        try:
+            os.makedirs(pth, exist_ok=True)
+            cache = FileSystemBytecodeCache(pth)
+        except OSError:
+            pass  # the cache is just an optimization
+    return Environment(loader=PackageLoader('getlino', 'templates'),
+                       bytecode_cache=cache, auto_reload=False)
 
 # currently getlino supports only nginx, maybe we might add other web servers
 # USE_NGINX = True
@@ -33,8 +66,9 @@ JINJA_ENV = Environment(loader=PackageLoader('getlino', 'templates'))
 BATCH_HELP = "Whether to run in batch mode, i.e. without asking any questions.  "\
              "Don't use this on a machine that is already being used."
 
-# note that we double curly braces because we will run format() on this string:
-LOGROTATE_CONF = """\
+# note that we double curly braces because this is an f-string:
+def logrotate_conf(logfile, usergroup):
+    return f"""\
 # generated by getlino
 {logfile} {{
     weekly
@@ -51,21 +85,22 @@ LOGROTATE_CONF = """\
 
 
 class WebServer(object):
-    apt_packages = ''
+    apt_packages = ()
     service = None
     name = None  # name must match certbot convention (nginx, apache)
 
 class Nginx(WebServer):
     name = 'nginx'
     service = 'nginx'
-    apt_packages = "nginx uwsgi-plugin-python3"
+    apt_packages = ("nginx", "uwsgi-plugin-python3")
 
 class Apache(WebServer):
     name = 'apache'
     service = 'apache2'
-    apt_packages = "apache2 libapache2-mod-wsgi"
+    apt_packages = ("apache2", "libapache2-mod-wsgi")
 
 WEB_SERVERS = [Nginx(), Apache()]
+WEB_SERVERS_DICT = {e.name: e for e in WEB_SERVERS}
 
 # def default_web_server():
 #     return ifroot("nginx", '')
@@ -73,15 +108,15 @@ WEB_SERVERS = [Nginx(), Apache()]
 def resolve_web_server(web_server):
     if not web_server:
         return None
-    for e in WEB_SERVERS:
-        if e.name == web_server:
-            return e
+    e = WEB_SERVERS_DICT.get(web_server, None)
+    if e is not None:
+        return e
     raise click.ClickException("Invalid --web-server '{}'.".format(web_server))
 
 class DbEngine(object):
     name = None  # Note that the DbEngine.name field must match the Django engine name
     service = None
-    apt_packages = ''
+    apt_packages = ()
     python_packages = ''
     needs_root = False
     "Whether you need to be root in order to create users and databases."
@@ -106,9 +141,11 @@ class SQLite(DbEngine):
         project_dir = context['project_dir']
         prjname = context['prjname']
         pth = Path(project_dir) / prjname
-        if os.path.exists(pth):
-            with i.override_batch(True):
+        with i.override_batch(True):
+            try:
                 i.check_permissions(pth)
+            except FileNotFoundError:
+                pass
 
 
 
@@ -116,7 +153,7 @@ class MySQL(DbEngine):
     name = 'mysql'
     service = 'mysql'
     default_port = "3306"
-    apt_packages = "mysql-server libmysqlclient-dev"
+    apt_packages = ("mysql-server", "libmysqlclient-dev")
     python_packages = "mysqlclient"
     needs_root = True
 
@@ -128,143 +165,421 @@ class MySQL(DbEngine):
         if distro.id() == "debian":
             # package name is mariadb but service name remains mysql
             # self.service = 'mariadb'
-            self.apt_packages = "mariadb-server libmariadb-dev-compat libmariadb-dev "\
-                "python-dev libffi-dev libssl-dev"
+            self.apt_packages = (
+                "mariadb-server", "libmariadb-dev-compat", "libmariadb-dev",
+                "python-dev", "libffi-dev", "libssl-dev")
                 # "python-dev libffi-dev libssl-dev python-mysqldb"
 
     def run(self, i, sqlcmd):
-        options = "" if i.batch else "-p"
-        return i.runcmd('mysql -u root {} -e "{};"'.format(options, sqlcmd))
+        argv = ['mysql', '-u', 'root']
+        if not i.batch:
+            argv.append('-p')
+        argv += ['-e', sqlcmd + ';']
+        return i.runcmd(argv)
 
     def setup_user(self, i, context):
-        self.run(i, "create user '{db_user}'@'{db_host}' identified by '{db_password}'".format(**context))
+        db_user, db_host = context['db_user'], context['db_host']
+        db_password = context['db_password']
+        self.run(i, f"create user '{db_user}'@'{db_host}' identified by '{db_password}'")
 
     def setup_database(self, i, database, user, db_host):
-        self.run(i, "create database {database} charset 'utf8'".format(**locals()))
-        self.run(i, "grant all PRIVILEGES on {database}.* to '{user}'@'{db_host}'".format(**locals()))
+        self.run(i, f"create database {database} charset 'utf8'")
+        self.run(i, f"grant all PRIVILEGES on {database}.* to '{user}'@'{db_host}'")
 
 class PostgreSQL(DbEngine):
     name = 'postgresql'
     service = 'postgresql'
-    apt_packages = "postgresql postgresql-contrib libpq-dev python-dev"
+    apt_packages = ("postgresql", "postgresql-contrib", "libpq-dev", "python-dev")
     # python_packages = "psycopg2"
     python_packages = "psycopg2-binary"
     default_port = "5432"
     needs_root = True
 
     def run(self, i, cmd):
-        assert '"' not in cmd
         # self.runcmd('sudo -u postgres bash -c "psql -c \\\"{}\\\""'.format(cmd))
-        i.runcmd('sudo -u postgres psql -c "{}"'.format(cmd))
+        i.runcmd(['sudo', '-u', 'postgres', 'psql', '-c', cmd])
 
     def setup_user(self, i, context):
-        self.run(i, "CREATE USER {db_user} WITH PASSWORD '{db_password}';".format(**context))
+        db_user, db_password = context['db_user'], context['db_password']
+        self.run(i, f"CREATE USER {db_user} WITH PASSWORD '{db_password}';")
 
     def setup_database(self, i, database, user, db_host):
-        self.run(i, "CREATE DATABASE {database};".format(**locals()))
-        self.run(i, "GRANT ALL PRIVILEGES ON DATABASE {database} TO {user};".format(**locals()))
+        self.run(i, f"CREATE DATABASE {database};")
+        self.run(i, f"GRANT ALL PRIVILEGES ON DATABASE {database} TO {user};")
 
 
 DB_ENGINES = [MySQL(), PostgreSQL(), SQLite()]
+DB_ENGINES_DICT = {e.name: e for e in DB_ENGINES}
 
 def default_db_engine():
     return ifroot("mysql", 'sqlite3')
 
 def resolve_db_engine(db_engine):
-    for e in DB_ENGINES:
-        if e.name == db_engine:
-            return e
+    e = DB_ENGINES_DICT.get(db_engine, None)
+    if e is not None:
+        return e
     raise click.ClickException("Invalid --db-engine '{}'.".format(db_engine))
 
 
 
 Repo = collections.namedtuple(
-    'Repo', 'nickname package_name git_repo settings_module front_end')
-REPOS_DICT = {}
-KNOWN_REPOS = []
-
-def add(nickname, package_name, git_repo='', settings_module='', front_end=''):
-    t = Repo(nickname, package_name, git_repo, settings_module, front_end)
-    KNOWN_REPOS.append(t)
-    REPOS_DICT[t.nickname] = t
-    if t.front_end:
-        # add an alias because front ends are identified using their full package name
-        REPOS_DICT[t.front_end] = t
-
-# some tools to be installed with --clone because they are required for a complete contributor environment:
-add("cd", "commondata", "https://github.com/lsaffre/commondata")
-add("be", "commondata.be", "https://github.com/lsaffre/commondata-be")
-add("ee", "commondata.ee", "https://github.com/lsaffre/commondata-ee")
-add("eg", "commondata.eg", "https://github.com/lsaffre/commondata-eg")
-add("atelier", "atelier", "https://github.com/lino-framework/atelier")
-add("rstgen", "rstgen", "https://github.com/lino-framework/rstgen")
-add("etgen", "etgen", "https://github.com/lino-framework/etgen")
-add("eid", "eidreader", "https://github.com/lino-framework/eidreader")
-
-add("lino", "lino", "https://github.com/lino-framework/lino", "", "lino.modlib.extjs")
-add("xl", "lino-xl", "https://github.com/lino-framework/xl")
-add("welfare", "lino-welfare", "https://github.com/lino-framework/welfare")
-add("amici", "lino-amici", "https://github.com/lino-framework/amici", "lino_amici.lib.amici.settings")
-add("avanti", "lino-avanti", "https://github.com/lino-framework/avanti", "lino_avanti.lib.avanti.settings")
-add("care", "lino-care", "https://github.com/lino-framework/care", "lino_care.lib.care.settings")
-add("cosi", "lino-cosi", "https://github.com/lino-framework/cosi", "lino_cosi.lib.cosi.settings")
-add("noi", "lino-noi", "https://github.com/lino-framework/noi", "lino_noi.lib.noi.settings")
-add("presto", "lino-presto", "https://github.com/lino-framework/presto", "lino_presto.lib.presto.settings")
-add("pronto", "lino-pronto", "https://github.com/lino-framework/pronto", "lino_pronto.lib.pronto.settings")
-add("tera", "lino-tera", "https://github.com/lino-framework/tera", "lino_tera.lib.tera.settings")
-add("vilma", "lino-vilma", "https://github.com/lino-framework/vilma", "lino_vilma.lib.vilma.settings")
-add("voga", "lino-voga", "https://github.com/lino-framework/voga", "lino_voga.lib.voga.settings")
-add("weleup", "lino-weleup", "https://github.com/lino-framework/weleup", "lino_weleup.settings")
-add("welcht", "lino-welcht", "https://github.com/lino-framework/welcht", "lino_welcht.settings")
-add("ciao", "lino-ciao", "https://github.com/lino-framework/ciao", "lino_ciao.lib.ciao.settings")
-
-add("book", "lino-book", "https://github.com/lino-framework/book")
-add("react", "lino-react", "https://github.com/lino-framework/react", "", "lino_react.react")
-add("openui5", "lino-openui5", "https://github.com/lino-framework/openui5", "", "lino_openui5.openui5")
-
-# experimental: applications that have no repo on their own
-add("min1", "", "", "lino_book.projects.min1.settings")
-add("min2", "", "", "lino_book.projects.min2.settings")
-add("polls", "", "", "lino_book.projects.polls.mysite.settings")
-add("cosi_ee", "", "", "lino_book.projects.cosi_ee.settings.demo")
-add("lydia", "", "", "lino_book.projects.lydia.settings.demo")
-add("noi1e", "", "", "lino_book.projects.noi1e.settings.demo")
-add("chatter", "", "", "lino_book.projects.chatter.settings")
-
-# e.g. for installing a non-Lino site like mailman
-add("std", "", "", "lino.projects.std.settings")
-
-APPNAMES = [a.nickname for a in KNOWN_REPOS if a.settings_module]
-FRONT_ENDS = [a for a in KNOWN_REPOS if a.front_end]
+    'Repo', 'nickname package_name git_repo settings_module front_end repo_nickname')
+
+_REPO_TABLE = (
+    # some tools to be installed with --clone because they are required for a complete contributor environment:
+    ("cd", "commondata", "https://github.com/lsaffre/commondata"),
+    ("be", "commondata.be", "https://github.com/lsaffre/commondata-be"),
+    ("ee", "commondata.ee", "https://github.com/lsaffre/commondata-ee"),
+    ("eg", "commondata.eg", "https://github.com/lsaffre/commondata-eg"),
+    ("atelier", "atelier", "https://github.com/lino-framework/atelier"),
+    ("rstgen", "rstgen", "https://github.com/lino-framework/rstgen"),
+    ("etgen", "etgen", "https://github.com/lino-framework/etgen"),
+    ("eid", "eidreader", "https://github.com/lino-framework/eidreader"),
+
+    ("lino", "lino", "https://github.com/lino-framework/lino", "", "lino.modlib.extjs"),
+    ("xl", "lino-xl", "https://github.com/lino-framework/xl"),
+    ("welfare", "lino-welfare", "https://github.com/lino-framework/welfare"),
+    ("amici", "lino-amici", "https://github.com/lino-framework/amici", "lino_amici.lib.amici.settings"),
+    ("avanti", "lino-avanti", "https://github.com/lino-framework/avanti", "lino_avanti.lib.avanti.settings"),
+    ("care", "lino-care", "https://github.com/lino-framework/care", "lino_care.lib.care.settings"),
+    ("cosi", "lino-cosi", "https://github.com/lino-framework/cosi", "lino_cosi.lib.cosi.settings"),
+    ("noi", "lino-noi", "https://github.com/lino-framework/noi", "lino_noi.lib.noi.settings"),
+    ("presto", "lino-presto", "https://github.com/lino-framework/presto", "lino_presto.lib.presto.settings"),
+    ("pronto", "lino-pronto", "https://github.com/lino-framework/pronto", "lino_pronto.lib.pronto.settings"),
+    ("tera", "lino-tera", "https://github.com/lino-framework/tera", "lino_tera.lib.tera.settings"),
+    ("vilma", "lino-vilma", "https://github.com/lino-framework/vilma", "lino_vilma.lib.vilma.settings"),
+    ("voga", "lino-voga", "https://github.com/lino-framework/voga", "lino_voga.lib.voga.settings"),
+    ("weleup", "lino-weleup", "https://github.com/lino-framework/weleup", "lino_weleup.settings"),
+    ("welcht", "lino-welcht", "https://github.com/lino-framework/welcht", "lino_welcht.settings"),
+    ("ciao", "lino-ciao", "https://github.com/lino-framework/ciao", "lino_ciao.lib.ciao.settings"),
+
+    ("book", "lino-book", "https://github.com/lino-framework/book"),
+    ("react", "lino-react", "https://github.com/lino-framework/react", "", "lino_react.react"),
+    ("openui5", "lino-openui5", "https://github.com/lino-framework/openui5", "", "lino_openui5.openui5"),
+
+    # experimental: applications that have no repo on their own
+    ("min1", "", "", "lino_book.projects.min1.settings"),
+    ("min2", "", "", "lino_book.projects.min2.settings"),
+    ("polls", "", "", "lino_book.projects.polls.mysite.settings"),
+    ("cosi_ee", "", "", "lino_book.projects.cosi_ee.settings.demo"),
+    ("lydia", "", "", "lino_book.projects.lydia.settings.demo"),
+    ("noi1e", "", "", "lino_book.projects.noi1e.settings.demo"),
+    ("chatter", "", "", "lino_book.projects.chatter.settings"),
+
+    # e.g. for installing a non-Lino site like mailman
+    ("std", "", "", "lino.projects.std.settings"),
+)
+
+KNOWN_REPOS = tuple(
+    Repo(nickname, package_name, git_repo, settings_module, front_end,
+         git_repo.split('/')[-1])
+    for nickname, package_name, git_repo, settings_module, front_end
+    in (row + ('',) * (5 - len(row)) for row in _REPO_TABLE))
+
+REPOS_DICT = {r.nickname: r for r in KNOWN_REPOS}
+# add an alias because front ends are identified using their full package name
+REPOS_DICT.update({r.front_end: r for r in KNOWN_REPOS if r.front_end})
+REPOS_DICT = MappingProxyType(REPOS_DICT)  # read-only
+
+APPNAMES = tuple(a.nickname for a in KNOWN_REPOS if a.settings_module)
+FRONT_ENDS = tuple(a for a in KNOWN_REPOS if a.front_end)
+
+# the same syntax as accepted by configparser (without interpolation)
+_SECTION_RE = re.compile(r'\[([^\]]+)\]$')
+_OPTION_RE = re.compile(r'(.*?)\s*[=:]\s*(.*)$')
+
+BOOLEAN_STATES = {'1': True, 'yes': True, 'true': True, 'on': True,
+                  '0': False, 'no': False, 'false': False, 'off': False}
+
+
+class ConfigSection(dict):
+    """A plain dict of option names to string values, with the
+    :meth:`getboolean` method known from :mod:`configparser`.
+    """
+
+    def getboolean(self, key, fallback=None):
+        v = self.get(key)
+        if v is None:
+            return fallback
+        try:
+            return BOOLEAN_STATES[v.lower()]
+        except KeyError:
+            raise ValueError("Not a boolean: {}".format(v))
+
+
+def _owned_by_us(pth):
+    """Whether the nearest existing directory of `pth` is owned by the
+    effective user."""
+    if not hasattr(os, 'geteuid'):
+        return True
+    while True:
+        try:
+            return os.stat(pth).st_uid == os.geteuid()
+        except FileNotFoundError:
+            parent = os.path.dirname(pth)
+            if parent == pth:
+                return False
+            pth = parent
+
+
+class FastIni(object):
+    """A minimal reader and writer for :xfile:`getlino.conf` files.
+
+    Replaces :class:`configparser.ConfigParser`, which does interpolation and
+    section proxies we don't need.  Every file is read only once into a plain
+    dict per section.
+    """
+    default_section = 'DEFAULT'
+
+    def __init__(self):
+        self._d = {self.default_section: ConfigSection()}
+
+    @property
+    def defaults(self):
+        return self._d[self.default_section]
+
+    def read(self, filenames):
+        """Read and parse the given files.  Return the list of files that
+        have been successfully read.  Files that don't exist are silently
+        ignored."""
+        found = []
+        for fn in filenames:
+            try:
+                with open(fn) as fd:
+                    text = fd.read()
+            except OSError:
+                continue
+            self._parse(text, fn)
+            found.append(fn)
+        return found
+
+    def _parse(self, text, filename='<string>'):
+        d = self.defaults
+        key = None  # the option that an indented line would continue
+        for lineno, line in enumerate(text.splitlines(), 1):
+            s = line.strip()
+            if not s:
+                key = None
+                continue
+            if s[0] in '#;':
+                continue
+            indent = len(line) - len(line.lstrip())
+            if key is not None and indent > key_indent:
+                d[key] += '\n' + s  # continuation line
+                continue
+            m = _SECTION_RE.match(s)
+            if m:
+                d = self._d.setdefault(m.group(1).strip(), ConfigSection())
+                key = None
+                continue
+            m = _OPTION_RE.match(s)
+            if m and m.group(1):
+                key, key_indent = m.group(1).lower(), indent
+                d[key] = m.group(2)
+                continue
+            click.echo("Warning: {}:{}: ignoring invalid line {!r}".format(
+                filename, lineno, line), err=True)
+
+    def get(self, key, default=None):
+        return self.defaults.get(key, default)
+
+    def set(self, section, key, value):
+        self._d.setdefault(section, ConfigSection())[key] = value
+
+    def write(self, fd):
+        for section, d in self._d.items():
+            if section != self.default_section and not d:
+                continue
+            fd.write("[{}]\n".format(section))
+            # continuation lines must be indented, as with configparser
+            fd.write("\n".join("{} = {}".format(k, v.replace('\n', '\n\t'))
+                                for k, v in d.items()))
+            fd.write("\n\n")
+
 
 CONF_FILES = ['/etc/getlino/getlino.conf', expanduser('~/.getlino.conf')]
-CONFIG = configparser.ConfigParser()
-FOUND_CONFIG_FILES = CONFIG.read(CONF_FILES)
-DEFAULTSECTION = CONFIG[CONFIG.default_section]
+CONFIG = FastIni()
+FOUND_CONFIG_FILES = []
+DEFAULTSECTION = CONFIG.defaults
+
+
+@functools.lru_cache(maxsize=None)
+def load_config():
+    """Read the config files into :data:`DEFAULTSECTION`.
+
+    This is done only once per process, and only when a command actually needs
+    the configuration (not e.g. for ``getlino --help``).
+    """
+    FOUND_CONFIG_FILES.extend(CONFIG.read(CONF_FILES))
+
+
+BOOLEAN_OPTIONS = ('clone', 'webdav', 'appy', 'redis', 'devtools', 'https',
+                   'ldap', 'monit', 'linod')
+
+
+class ConfigSnapshot(SimpleNamespace):
+    """The options of :data:`DEFAULTSECTION`, read once and available as
+    attributes.  Boolean options are converted to bool.  Unknown options are
+    `None`, like :meth:`dict.get`.
+    """
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return None
+
+
+def config_snapshot():
+    load_config()
+    cfg = ConfigSnapshot(**DEFAULTSECTION)
+    for k in BOOLEAN_OPTIONS:
+        setattr(cfg, k, DEFAULTSECTION.getboolean(k))
+    return cfg
+
+# the effective user doesn't change while getlino is running
+_IS_ROOT = hasattr(os, 'geteuid') and os.geteuid() == 0
 
 def ifroot(true=True, false=False):
-    if not hasattr(os, 'geteuid'):
-        return false
-    if os.geteuid() == 0:
+    if _IS_ROOT:
         return true
     return false
 
+@functools.lru_cache(maxsize=None)
+def _group_gid(usergroup):
+    # the gid of the named group, or None if there is no such group
+    if not usergroup:
+        return None
+    try:
+        return grp.getgrnam(usergroup).gr_gid
+    except KeyError:
+        return None
+
 def has_usergroup(usergroup):
-    for gid in os.getgroups():
-        if grp.getgrgid(gid).gr_name == usergroup:
-            return True
-    return False
+    gid = _group_gid(usergroup)
+    return gid is not None and gid in os.getgroups()
+
+# the access permissions wanted by Installer.check_permissions()
+FILE_MODE = stat.S_IRGRP | stat.S_IWGRP | stat.S_IRUSR | stat.S_IWUSR | stat.S_IROTH
+EXEC_MODE = FILE_MODE | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+DIR_MODE = EXEC_MODE | stat.S_ISGID
+
+def read_keys(fd):
+    """Yield the keys typed on the terminal `fd`, one by one.
+
+    The terminal is switched to cbreak mode only once for all keys.  Escape
+    sequences (e.g. cursor keys) are skipped.  Use it with
+    :func:`contextlib.closing` so that the terminal mode is restored as soon
+    as the caller stops reading.
+    """
+    old = termios.tcgetattr(fd)
+    try:
+        tty.setcbreak(fd)
+        while True:
+            c = os.read(fd, 1)
+            if not c:
+                return
+            if c == b'\x1b':
+                if not select.select([fd], [], [], 0)[0]:
+                    continue  # a lone ESC, don't wait for the next key
+                if os.read(fd, 1) == b'[':
+                    # skip a CSI sequence up to its final byte
+                    while not 0x40 <= ord(os.read(fd, 1) or b'~') <= 0x7e:
+                        pass
+                continue
+            yield c.decode(errors='replace')
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old)
+
+
+def read_answers():
+    """Yield the answers typed on stdin, one character per answer.
+
+    Every line is an answer when stdin is not a terminal (e.g. when answers
+    are piped in), otherwise every key.  Use it with
+    :func:`contextlib.closing` like :func:`read_keys`.
+    """
+    if not sys.stdin.isatty():
+        for line in iter(sys.stdin.readline, ''):
+            yield line[:1]
+    elif termios is None:
+        while True:
+            yield click.getchar()
+    else:
+        with closing(read_keys(sys.stdin.fileno())) as keys:
+            yield from keys
+
 
 def which_certbot():
     for x in ["certbot",  "certbot-auto"]:
         if shutil.which(x):
             return x
 
+# characters that make us run a command string through the shell
+SHELL_SYNTAX = re.compile(r'[|&;<>()$`\\"\'*?\[\]#~=%{}\n]')
+
+# the keys accepted as answer by Installer.yes_or_no()
+YES_CHARS = frozenset("yY")
+NO_CHARS = frozenset("nN")
+
+# maximum number of git clone processes to run at the same time
+CLONE_WORKERS = 4
+
+# make dpkg keep existing config files instead of asking about them
+APT_KEEP_CONFFILES = ['-o', 'Dpkg::Options::=--force-confdef',
+                      '-o', 'Dpkg::Options::=--force-confold']
+
+# don't run apt-get update when the package lists are younger than this
+# (in seconds)
+APT_CACHE_MAX_AGE = 24 * 3600
+
+
+APT_LISTS = '/var/lib/apt/lists'
+APT_UPDATE_STAMP = '/var/lib/apt/periodic/update-success-stamp'
+APT_SOURCES = ('/etc/apt/sources.list', '/etc/apt/sources.list.d')
+
+
+def apt_cache_is_fresh(lists=APT_LISTS, stamp=APT_UPDATE_STAMP,
+                       sources=APT_SOURCES):
+    """Whether the apt package lists exist, were updated less than
+    :data:`APT_CACHE_MAX_AGE` seconds ago and after the last change in the
+    apt sources.
+
+    The time of the last update is taken from the stamp file written after
+    a successful `apt-get update` when it exists, otherwise from the lists
+    directory.  Note that :file:`pkgcache.bin` would be misleading because
+    any apt run can rebuild it.
+    """
+    try:
+        with os.scandir(lists) as it:
+            # e.g. docker images often have empty lists, or compressed ones
+            # like "*_Packages.lz4"
+            if not any('_Packages' in e.name for e in it):
+                return False
+        try:
+            updated = os.stat(stamp).st_mtime
+        except FileNotFoundError:
+            updated = os.stat(lists).st_mtime
+    except FileNotFoundError:
+        return False
+    if time.time() - updated > APT_CACHE_MAX_AGE:
+        return False
+    for pth in sources:
+        try:
+            if os.stat(pth).st_mtime > updated:
+                return False
+        except FileNotFoundError:
+            pass
+    return True
+
+
 class Installer(object):
     """Volatile object used by :mod:`getlino.configure` and :mod:`getlino.startsite`.
     """
-    def __init__(self, batch=False):
+    def __init__(self, batch=False, cfg=None):
         self.batch = batch
+        if cfg is None:
+            cfg = config_snapshot()
+        self.cfg = cfg
         # self.asroot = ifroot()
         self._services = set()
         self._system_packages = set()
@@ -279,31 +594,38 @@ class Installer(object):
         """If `pth` (directory or file) exists, remove it after asking for confirmation.
         Return False if it exists and user doesn't confirm.
         """
-        if not os.path.exists(pth):
+        try:
+            si = os.lstat(pth)
+        except FileNotFoundError:
             return True
-        if os.path.isdir(pth):
-            if self.yes_or_no("Overwrite existing directory {} ?".format(pth)):
+        if stat.S_ISDIR(si.st_mode):
+            if self.batch or self.yes_or_no("Overwrite existing directory {} ?".format(pth)):
                 shutil.rmtree(pth)
                 return True
         else:
-            if self.yes_or_no("Overwrite existing file {} ?".format(pth)):
+            if self.batch or self.yes_or_no("Overwrite existing file {} ?".format(pth)):
                 os.remove(pth)
                 return True
         return False
 
-    def yes_or_no(self, msg, yes="yY", no="nN", default=True):
+    def yes_or_no(self, msg, yes=YES_CHARS, no=NO_CHARS, default=True):
         """Ask for confirmation without accepting a mere RETURN."""
         if self.batch:
             return default
         click.echo(msg + " [y or n]", nl=False)
-        while True:
-            c = click.getchar()
-            if c in yes:
-                click.echo(" Yes")
-                return True
-            elif c in no:
-                click.echo(" No")
-                return False
+        with closing(read_answers()) as answers:
+            for c in answers:
+                if c in yes:
+                    click.echo(" Yes")
+                    return True
+                elif c in no:
+                    click.echo(" No")
+                    return False
+                click.echo(" Please answer y or n.")
+                click.echo(msg + " [y or n]", nl=False)
+        # never take the default for an answer nobody gave
+        click.echo()
+        raise click.Abort()
 
     def must_restart(self, srvname):
         self._services.add(srvname)
@@ -311,6 +633,10 @@ class Installer(object):
     def runcmd(self, cmd, **kw):
         """Run the cmd similar as os.system(), but stop when Ctrl-C.
 
+        `cmd` is either a string to be run by the shell, or a list of
+        arguments to be executed directly, without a shell.  A string without
+        any shell syntax is executed directly as well.
+
         If the subprocess has non-zero return code, we simply stop. We don't use
         check=True because this would add another useless traceback.  The
         subprocess is responsible for reporting the reason of the error.
@@ -318,55 +644,153 @@ class Installer(object):
         """
         # kw.update(stdout=subprocess.PIPE)
         # kw.update(stderr=subprocess.STDOUT)
-        kw.update(shell=True)
+        if isinstance(cmd, str):
+            msg = cmd
+            if SHELL_SYNTAX.search(cmd):
+                kw.update(shell=True)
+            else:
+                cmd = shlex.split(cmd)
+        else:
+            msg = ' '.join(shlex.quote(a) for a in cmd)
         kw.update(universal_newlines=True)
+        if self.batch:
+            # nobody is going to answer questions in batch mode
+            kw.setdefault('stdin', subprocess.DEVNULL)
         # kw.update(check=True)
         # subprocess.check_output(cmd, **kw)
-        if self.batch or self.yes_or_no("run {}".format(cmd), default=True):
-            click.echo(cmd)
+        if self.batch or self.yes_or_no("run {}".format(msg), default=True):
+            click.echo(msg)
             cp = subprocess.run(cmd, **kw)
             if cp.returncode != 0:
                 # subprocess.run("sudo journalctl -xe", **kw)
                 raise click.ClickException(
-                "{} ended with return code {}".format(cmd, cp.returncode))
+                f"{msg} ended with return code {cp.returncode}")
 
-    def apt_install(self, packages):
-        for pkg in packages.split():
-            # no check for if package is already installed:
-            self._system_packages.add(pkg)
+    def apt_upgrade(self):
+        """Run `apt-get update` and `apt-get upgrade`.  Requires root
+        privileges.  The update is skipped when :func:`apt_cache_is_fresh`.
 
-    def run_in_env(self, env, cmd):
+        In batch mode dpkg keeps existing config files, otherwise the user
+        can answer its questions.
+        """
+        argv = ['apt-get', 'upgrade', '-y']
+        kw = dict()
+        if self.batch:
+            argv += APT_KEEP_CONFFILES
+            kw.update(env=dict(os.environ, DEBIAN_FRONTEND='noninteractive'))
+        else:
+            kw.update(stdin=None)  # don't let runcmd() close stdin
+        with self.override_batch(True):
+            if apt_cache_is_fresh():
+                click.echo("apt cache is fresh, skipping apt-get update.")
+            else:
+                self.runcmd(['apt-get', 'update', '-y'], **kw)
+            self.runcmd(argv, **kw)
+
+    def apt_install(self, packages):
+        """Add the given packages to the system packages to install.
+        `packages` is either a space-separated string or an iterable."""
+        if isinstance(packages, str):
+            packages = packages.split()
+        # no check for if package is already installed:
+        self._system_packages.update(packages)
+
+    def run_in_env(self, env, cmd, **kw):
         """env is the path of the virtualenv"""
         # click.echo(cmd)
-        cmd = ". {}/bin/activate && {}".format(env, cmd)
-        self.runcmd(cmd)
-
-    def check_permissions(self, pth, executable=False):
-        si = os.stat(pth)
+        argv = None if SHELL_SYNTAX.search(cmd) else shlex.split(cmd)
+        if argv and argv[0] in ('pip', 'python'):
+            # no need to source the activate script
+            argv[0] = join(env, 'bin', argv[0])
+            environ = dict(os.environ, VIRTUAL_ENV=env)
+            environ.update(PATH=join(env, 'bin') + os.pathsep + environ.get('PATH', ''))
+            self.runcmd(argv, env=environ, **kw)
+        else:
+            cmd = f". {env}/bin/activate && {cmd}"
+            self.runcmd(cmd, **kw)
+
+    def usergroup_gid(self):
+        """Return the gid of the configured usergroup, or None if no usergroup
+        is configured.  Raise an error if the group doesn't exist."""
+        usergroup = self.cfg.usergroup
+        if not usergroup:
+            return None
+        gid = _group_gid(usergroup)
+        if gid is None:
+            raise click.ClickException(
+                "Invalid --usergroup '{}': no such group.".format(usergroup))
+        return gid
+
+    def check_permissions(self, pth, executable=False, si=None):
+        """Fix the group owner and access permissions of `pth`.  `si` can be
+        the result of a stat() done by the caller."""
+        if si is None:
+            si = os.stat(pth)
 
         if grp and ifroot():
             # check whether group owner is what we want
-            usergroup = DEFAULTSECTION.get('usergroup')
-            if grp.getgrgid(si.st_gid).gr_name != usergroup:
+            gid = self.usergroup_gid()
+            if gid is not None and si.st_gid != gid:
                 if self.batch or self.yes_or_no("Set group owner for {}".format(pth),
                                                 default=True):
-                    shutil.chown(pth, group=usergroup)
+                    os.chown(pth, -1, gid)
 
         # check access permissions
-        mode = stat.S_IRGRP | stat.S_IWGRP
-        mode |= stat.S_IRUSR | stat.S_IWUSR
-        mode |= stat.S_IROTH
-        if stat.S_ISDIR(si.st_mode):
-            mode |= stat.S_ISGID | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
-        elif executable:
-            mode |= stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
-        imode = stat.S_IMODE(si.st_mode)
-        if imode ^ mode:
-            msg = "Set mode for {} from {} to {}".format(
-                pth, imode, mode)
-            # pth, stat.filemode(imode), stat.filemode(mode))
-            if self.batch or self.yes_or_no(msg, default=True):
-                os.chmod(pth, mode)
+        mode = DIR_MODE if stat.S_ISDIR(si.st_mode) else (
+            EXEC_MODE if executable else FILE_MODE)
+        imode = si.st_mode & 0o7777
+        if imode == mode:
+            return
+        # the message is built only when we are going to ask
+        if self.batch or self.yes_or_no("Set mode for {} from {} to {}".format(
+                pth, imode, mode), default=True):
+                # pth, stat.filemode(imode), stat.filemode(mode)), default=True):
+            os.chmod(pth, mode)
+
+    def ensure_dir(self, pth, prompt=None):
+        """Create the directory `pth` unless it exists, then check its
+        permissions.  If `prompt` is given, ask it (formatted with `pth`)
+        before creating the directory."""
+        try:
+            si = os.stat(pth)
+        except FileNotFoundError:
+            if prompt and not self.batch and not self.yes_or_no(
+                    prompt.format(pth), default=True):
+                return
+            try:
+                os.makedirs(pth, exist_ok=True)
+            except PermissionError as e:
+                raise click.ClickException(
+                    "Cannot create directory {} : {}".format(pth, e))
+            si = None
+        self.check_permissions(pth, si=si)
+
+    def check_permissions_tree(self, root, exclude=()):
+        """Fix the permissions of `root` like :meth:`check_permissions`, and
+        set the group owner of everything below it, without asking.
+
+        Below `root`, directories also get the setgid bit, but no other
+        permission bits are added, so private files remain private.
+        Symbolic links are not followed.  `exclude` is a list of names
+        directly below `root` to skip (e.g. the virtualenv).
+        """
+        with self.override_batch(True):
+            self.check_permissions(root)
+        gid = None
+        if grp and ifroot():
+            gid = self.usergroup_gid()
+        for dirpath, dirnames, filenames, dirfd in os.fwalk(root):
+            if dirpath == root:
+                dirnames[:] = [n for n in dirnames if n not in exclude]
+            for name in dirnames + filenames:
+                si = os.stat(name, dir_fd=dirfd, follow_symlinks=False)
+                if stat.S_ISLNK(si.st_mode):
+                    continue
+                if gid is not None and si.st_gid != gid:
+                    os.chown(name, -1, gid, dir_fd=dirfd, follow_symlinks=False)
+                if stat.S_ISDIR(si.st_mode) and not si.st_mode & stat.S_ISGID:
+                    os.chmod(name, stat.S_IMODE(si.st_mode) | stat.S_ISGID,
+                             dir_fd=dirfd)
 
     @contextmanager
     def override_batch(self, batch):
@@ -377,37 +801,49 @@ class Installer(object):
         finally:
             self.batch = old
 
-    def write_file(self, pth, content, **kwargs):
-        if self.check_overwrite(pth):
-            with open(pth, 'w') as fd:
+    def write_file(self, pth, content, force=False, executable=False):
+        """Write `content` to the file `pth` and check its permissions.
+        Ask before overwriting an existing file unless `force` is True."""
+        if force or self.check_overwrite(pth):
+            # create the file with the wanted mode so that usually (unless the
+            # umask removes some bits) check_permissions() has nothing to fix
+            mode = EXEC_MODE if executable else FILE_MODE
+            flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+            with open(os.open(pth, flags, mode), 'w', encoding='utf-8') as fd:
                 fd.write(content)
+                si = os.fstat(fd.fileno())
             with self.override_batch(True):
-                self.check_permissions(pth, **kwargs)
+                self.check_permissions(pth, executable, si)
             return True
 
     def write_daily_cron_job(self, filename, content):
         fn = Path('/etc/cron.daily') / filename
         if fn.exists():
             return
-        self.write_file(fn, content)
-        self.check_permissions(fn, executable=True)
+        self.write_file(fn, content, executable=True)
 
     def write_supervisor_conf(self, filename, content):
         self.write_file(
-            Path(DEFAULTSECTION.get('supervisor_dir')) / filename, content)
+            Path(self.cfg.supervisor_dir) / filename, content)
         self.must_restart('supervisor')
 
     def make_file_executable(self,file_path):
         """ Make a file executable """
-        st = os.stat(file_path)
         os.chmod(file_path,0o775)
-        #os.chmod(file_path, st.st_mode | stat.S_IEXEC)
 
-    def check_virtualenv(self, envdir, context):
+    def check_virtualenv(self, envdir, context, app_data=None):
+        """Create the virtualenv `envdir` unless it exists.
+
+        If `app_data` is given, it is a directory shared by several
+        virtualenvs, and the seed packages (pip, setuptools, wheel) are
+        symlinked from there instead of being installed into every new
+        virtualenv.
+        """
         pull_sh_path = Path(envdir) / 'bin' / 'pull.sh'
         ok = False
         if os.path.exists(envdir):
             ok = True
+            new_pull_sh = not pull_sh_path.exists()
             # msg = "Update virtualenv in {}"
             # return self.batch or click.confirm(msg.format(envdir), default=True)
         else:
@@ -416,26 +852,55 @@ class Installer(object):
                 # create an empty directory and fix permissions
                 os.makedirs(envdir)
                 self.check_permissions(envdir)
-                virtualenv.cli_run([envdir,'--python','python3'])
-                ok = True
+                import virtualenv  # slow, so import it only when needed
+                args = [envdir, '--python', 'python3']
+                if app_data:
+                    args += ['--app-data', app_data, '--symlink-app-data']
+                virtualenv.cli_run(args)
+                ok = new_pull_sh = True
         if ok:
             context.update(envdir=envdir)
-            if not os.path.exists(pull_sh_path):
+            if new_pull_sh:
                 self.jinja_write(pull_sh_path, **context)
             self.make_file_executable(pull_sh_path)
         return ok
 
-    def clone_repo(self, repo):
-        branch = DEFAULTSECTION.get('branch')
-        if not os.path.exists(repo.nickname):
-            self.runcmd("git clone --depth 1 -b {} {} {}".format(branch, repo.git_repo, repo.nickname))
+    def clone_repo(self, repo, repos_dir=''):
+        """Clone the given repository into `repos_dir` (default is the current
+        directory)."""
+        branch = self.cfg.branch
+        if not os.path.exists(join(repos_dir, repo.nickname)):
+            self.runcmd(
+                ['git', 'clone', '-q', '--depth', '1', '-b', branch, repo.git_repo, repo.nickname],
+                cwd=repos_dir or None)
         else:
             click.echo(
                 "No need to clone {} : directory exists.".format(
                     repo.nickname))
 
-    def install_repo(self, repo, env):
-        self.run_in_env(env, "pip install -q -e {}".format(repo.nickname))
+    def clone_repos(self, repos, repos_dir=''):
+        """Clone the given repositories into `repos_dir`, running several
+        :cmd:`git clone` processes in parallel."""
+        if len(repos) == 0:
+            return
+        if not self.batch and not self.yes_or_no(
+                "Clone {} repositories to {} ?".format(
+                    len(repos), repos_dir or os.getcwd()), default=True):
+            return
+        # we cannot ask questions from several threads
+        with self.override_batch(True):
+            with ThreadPoolExecutor(max_workers=CLONE_WORKERS) as ex:
+                list(ex.map(lambda r: self.clone_repo(r, repos_dir), repos))
+
+    def install_repo(self, repo, env, repos_dir=''):
+        self.install_repos([repo], env, repos_dir)
+
+    def install_repos(self, repos, env, repos_dir=''):
+        """Install the given repositories in a single pip call."""
+        if len(repos) == 0:
+            return
+        self.run_in_env(env, "pip install -q " + ' '.join(
+            ["-e " + shlex.quote(join(repos_dir, r.nickname)) for r in repos]))
 
     def check_usergroup(self, usergroup):
         # not used since 20200720
@@ -451,12 +916,9 @@ sudo adduser `whoami` {1}"""
         raise click.ClickException(msg.format(getpass.getuser(), usergroup))
 
     def write_logrotate_conf(self, conffile, logfile):
-        ctx = {}
-        ctx.update(DEFAULTSECTION)
-        ctx.update(logfile=logfile)
         self.write_file(
             '/etc/logrotate.d/' + conffile,
-            LOGROTATE_CONF.format(**ctx))
+            logrotate_conf(logfile, self.cfg.usergroup))
 
 
     def jinja_write(self, pth, tplname=None, **context):
@@ -468,10 +930,9 @@ sudo adduser `whoami` {1}"""
             return False
         if tplname is None:
             head, tplname = os.path.split(pth)
-        tpl = JINJA_ENV.get_template(tplname)
+        tpl = jinja_env().get_template(tplname)
         s = tpl.render(**context)
-        with open(pth, 'w') as fh:
-            fh.write(s)
+        Path(pth).write_text(s, encoding='utf-8')
         return True
 
     def run_apt_install(self):
@@ -479,21 +940,22 @@ sudo adduser `whoami` {1}"""
             return
         # click.echo("Must install {} system packages: {}".format(
         #     len(self._system_packages), ' '.join(self._system_packages)))
-        cmd = "apt-get install -q "
+        argv = ['apt-get', 'install', '-q']
         if self.batch:
-            cmd += "-y "
-        cmd +=  ' '.join(self._system_packages)
-        self._system_packages = []
+            argv += ['-y'] + APT_KEEP_CONFFILES
+        argv += sorted(self._system_packages)
+        self._system_packages = set()
         if ifroot():
             pass
         elif has_usergroup('sudo'):
-            cmd = "sudo " + cmd
+            argv = ['sudo'] + argv
         else:
             click.echo(
                 "The following command was not executed "
-                "because you cannot sudo:\n{}".format(cmd))
+                "because you cannot sudo:\n{}".format(
+                    ' '.join(shlex.quote(a) for a in argv)))
             return
-        self.runcmd(cmd)
+        self.runcmd(argv)
 
     def restart_services(self):
         if len(self._services) == 0:
@@ -506,12 +968,39 @@ sudo adduser `whoami` {1}"""
             return
         msg = "Restart services {}".format(self._services)
         if self.batch or self.yes_or_no(msg, default=True):
+            services = sorted(self._services)
+            # a service restarted now needn't be restarted again later
+            self._services = set()
+            sudo = [] if ifroot() else ['sudo']
             with self.override_batch(True):
-                for srv in self._services:
+                if os.path.isdir('/run/systemd/system'):
+                    # systemd can restart all services in a single command
                     try:
-                        self.runcmd("sudo service {} restart".format(srv))
+                        self.runcmd(sudo + ['systemctl', 'restart'] + services)
+                        return
                     except Exception:
-                        try:
-                            self.runcmd("sudo /etc/init.d/{}  restart".format(srv))
-                        except Exception:
-                            continue
+                        pass
+                # one shell (and one sudo) for all services
+                script = "; ".join(
+                    f"service {srv} restart || /etc/init.d/{srv} restart"
+                    for srv in map(shlex.quote, services))
+                try:
+                    self.runcmd(sudo + ['sh', '-c', script])
+                except Exception:
+                    pass
+
+
+_installer = None
+
+def get_installer(batch=False):
+    """Return the :class:`Installer` of this process, creating it if needed.
+
+    When several commands run in the same process, they share the services
+    to restart and the system packages to install.
+    """
+    global _installer
+    if _installer is None:
+        _installer = Installer(batch)
+    else:
+        _installer.batch = batch
+    return _installer
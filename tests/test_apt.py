@@ -0,0 +1,71 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import time
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from atelier.test import TestCase
+
+from getlino.utils import apt_cache_is_fresh, APT_CACHE_MAX_AGE
+
+
+def touch(pth, mtime=None):
+    with open(pth, 'w'):
+        pass
+    if mtime is not None:
+        os.utime(pth, (mtime, mtime))
+
+
+class AptCacheTests(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.lists = join(self.tmp.name, 'lists')
+        os.mkdir(self.lists)
+        self.stamp = join(self.tmp.name, 'update-success-stamp')
+        self.sources = join(self.tmp.name, 'sources.list')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def is_fresh(self):
+        return apt_cache_is_fresh(self.lists, self.stamp, [self.sources])
+
+    def test_empty_lists(self):
+        self.assertFalse(self.is_fresh())
+        touch(join(self.lists, 'lock'))
+        self.assertFalse(self.is_fresh())
+
+    def test_missing_lists(self):
+        self.assertFalse(apt_cache_is_fresh(
+            join(self.tmp.name, 'nonexistent'), self.stamp, [self.sources]))
+
+    def test_plain_lists(self):
+        touch(join(self.lists, 'deb.debian.org_debian_dists_buster_main_binary-amd64_Packages'))
+        self.assertTrue(self.is_fresh())
+
+    def test_compressed_lists(self):
+        # docker images store the lists compressed
+        for ext in ('lz4', 'gz', 'xz'):
+            with self.subTest(ext=ext):
+                fn = join(self.lists, 'deb.debian.org_debian_dists_buster_main_binary-amd64_Packages.' + ext)
+                touch(fn)
+                self.assertTrue(self.is_fresh())
+                os.remove(fn)
+
+    def test_stale_stamp(self):
+        touch(join(self.lists, 'x_Packages.lz4'))
+        touch(self.stamp, time.time() - APT_CACHE_MAX_AGE - 60)
+        self.assertFalse(self.is_fresh())
+        touch(self.stamp)
+        self.assertTrue(self.is_fresh())
+
+    def test_newer_sources(self):
+        touch(join(self.lists, 'x_Packages.lz4'))
+        touch(self.stamp, time.time() - 60)
+        touch(self.sources)
+        self.assertFalse(self.is_fresh())
+        touch(self.sources, time.time() - 120)
+        self.assertTrue(self.is_fresh())
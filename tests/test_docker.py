@@ -2,6 +2,7 @@
 # License: BSD (see file COPYING for details)
 
 from os.path import dirname, join
+import re
 import time
 from atelier.test import TestCase
 import docker
@@ -13,18 +14,24 @@ class DockerTestMixin:
     docker_image = None
     tested_applications = ['cosi', 'noi', 'avanti']
 
-    def setUp(self):
-        if self.docker_image is None:
-            return
-        self.container = client.containers.run(
-            self.docker_image, command="/bin/bash", user='lino', tty=True, detach=True)
-            # self.docker_image, command="/bin/bash", user='lino', tty=True, detach=True)
+    # all tests of a class run in the same container
+    container = None
 
-    def tearDown(self):
-        if self.docker_image is None:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if cls.docker_image is None:
             return
-        self.container.stop()
-        self.container.remove()
+        cls.container = client.containers.run(
+            cls.docker_image, command="/bin/bash", user='lino', tty=True, detach=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.container is not None:
+            cls.container.stop()
+            cls.container.remove()
+            cls.container = None
+        super().tearDownClass()
 
     def run_docker_command(self, command):
         # exit_code, output = container.exec_run(command, user='lino')
@@ -50,6 +57,25 @@ class DockerTestMixin:
             else:
                 return output
 
+    def run_docker_script(self, *commands):
+        """Run the given commands in a single `bash -c` call, stopping at the
+        first command that fails.
+
+        Return a list with the output of every command.  Fail the test when
+        one of them failed.
+        """
+        steps = []
+        for n, command in enumerate(commands):
+            steps.append(command)
+            steps.append("echo __STEP_{}__".format(n))
+        output = self.run_docker_command(' && '.join(steps))
+        res = re.split(r'__STEP_\d+__\r?\n', output)
+        # every command that succeeded has printed its marker
+        self.assertEqual(len(res) - 1, len(commands),
+                         "Step {} of {} failed:\n{}".format(
+                             len(res), len(commands), output))
+        return res[:len(commands)]
+
     def do_test_contributor_env(self, application):
         """
         Test the instructions written on
@@ -144,19 +170,19 @@ class DebianDockerTest(DockerTestMixin, TestCase):
         # load bash aliases
         # res = self.run_docker_command(
         #    container, 'source /etc/getlino/lino_bash_aliases')
-        res = self.run_docker_command('ls -l')
-        self.assertIn('setup.py', res)
-        # create and activate a master virtualenv
-        self.run_docker_command('sudo mkdir -p /usr/local/lino/shared/env')
-        self.run_docker_command(
-            'cd /usr/local/lino/shared/env && sudo chown root:www-data . && sudo chmod g+ws . && virtualenv -p python3 master')
         mastercmd = ". /usr/local/lino/shared/env/master/bin/activate && {}"
         sudocmd = mastercmd.format("sudo env PATH=$PATH") + " {}"
-        # update pip to avoid warnings
-        self.run_docker_command(sudocmd.format('pip3 install -U pip'))
-        # install getlino (the dev version)
-        res = self.run_docker_command(sudocmd.format('pip3 install -e .'))
-        self.assertIn("Installing collected packages:", res)
+        res = self.run_docker_script(
+            'ls -l',
+            # create and activate a master virtualenv
+            'sudo mkdir -p /usr/local/lino/shared/env',
+            '(cd /usr/local/lino/shared/env && sudo chown root:www-data . && sudo chmod g+ws . && virtualenv -p python3 master)',
+            # update pip to avoid warnings
+            sudocmd.format('pip3 install -U pip'),
+            # install getlino (the dev version)
+            sudocmd.format('pip3 install -e .'))
+        self.assertIn('setup.py', res[0])
+        self.assertIn("Installing collected packages:", res[4])
         # print(self.run_docker_command(container, "sudo cat /etc/getlino/lino_bash_aliases"))
         cmd = 'getlino configure --batch --monit'
         if True:
@@ -178,10 +204,9 @@ class DebianDockerTest(DockerTestMixin, TestCase):
             # print(res)
             # res = self.run_docker_command(cmdtpl.format('pull.sh'))
             # print(res)
-            res = self.run_docker_command(cmdtpl.format('python manage.py prep --noinput'))
-            print(res)
-            res = self.run_docker_command(cmdtpl.format('./make_snapshot.sh'))
-            print(res)
+            self.run_docker_script(
+                cmdtpl.format('python manage.py prep --noinput'),
+                cmdtpl.format('./make_snapshot.sh'))
             # Wait 10 sec for supervisor to finish restarting
             time.sleep(20)
             res = self.run_docker_command('/usr/local/bin/healthcheck.sh')
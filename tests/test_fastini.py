@@ -0,0 +1,80 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import io
+from configparser import ConfigParser
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from atelier.test import TestCase
+
+from getlino.utils import FastIni
+
+SAMPLE = """\
+# a comment
+; another comment
+[DEFAULT]
+usergroup = www-data
+Languages = en de
+db_password =
+url = http://example.com/?a=b
+other : colon
+long = first line
+  second line
+
+[getlino]
+   indented = 1
+webdav = True
+"""
+
+
+class FastIniTests(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self, text):
+        fn = join(self.tmp.name, 'getlino.conf')
+        with open(fn, 'w') as fd:
+            fd.write(text)
+        c = FastIni()
+        self.assertEqual(c.read([fn, join(self.tmp.name, 'nonexistent')]), [fn])
+        return c
+
+    def test_read(self):
+        c = self.read(SAMPLE)
+        self.assertEqual(c.defaults['usergroup'], 'www-data')
+        # option names are case insensitive
+        self.assertEqual(c.defaults['languages'], 'en de')
+        self.assertEqual(c.defaults['db_password'], '')
+        # only the first "=" separates the value
+        self.assertEqual(c.defaults['url'], 'http://example.com/?a=b')
+        self.assertEqual(c.defaults['other'], 'colon')
+        self.assertEqual(c.defaults['long'], 'first line\nsecond line')
+        self.assertEqual(c._d['getlino']['indented'], '1')
+        self.assertIs(c._d['getlino'].getboolean('webdav'), True)
+
+    def test_same_as_configparser(self):
+        c = self.read(SAMPLE)
+        cp = ConfigParser(interpolation=None, default_section='DEFAULT')
+        cp.read_string(SAMPLE)
+        self.assertEqual(dict(c.defaults), dict(cp.defaults()))
+        self.assertEqual(dict(c._d['getlino']),
+                         {k: v for k, v in cp['getlino'].items()
+                          if k not in cp.defaults()})
+
+    def test_write(self):
+        c = self.read(SAMPLE)
+        c.set('getlino', 'more', 'a\nb\nc')
+        fd = io.StringIO()
+        c.write(fd)
+        c2 = self.read(fd.getvalue())
+        self.assertEqual(c2._d, c._d)
+        self.assertEqual(c2._d['getlino']['more'], 'a\nb\nc')
+        # configparser reads what we wrote
+        cp = ConfigParser(interpolation=None)
+        cp.read_string(fd.getvalue())
+        self.assertEqual(cp['DEFAULT']['long'], 'first line\nsecond line')
@@ -0,0 +1,63 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import os
+import stat
+from os.path import join
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+
+from atelier.test import TestCase
+
+from getlino.utils import Installer, DIR_MODE
+
+try:
+    import grp
+except ImportError:
+    grp = None
+
+
+def mode(pth):
+    return stat.S_IMODE(os.lstat(pth).st_mode)
+
+
+class PermissionsTreeTests(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.root = join(self.tmp.name, 'prj')
+        self.outside = join(self.tmp.name, 'outside')
+        os.makedirs(join(self.root, 'env', 'lib'))
+        os.makedirs(join(self.root, 'media', 'uploads'))
+        os.mkdir(self.outside)
+        for pth in (self.root, self.outside, join(self.root, 'env'),
+                    join(self.root, 'env', 'lib'), join(self.root, 'media'),
+                    join(self.root, 'media', 'uploads')):
+            os.chmod(pth, 0o755)
+        self.secret = join(self.root, 'secret.txt')
+        with open(self.secret, 'w'):
+            pass
+        os.chmod(self.secret, 0o600)
+        os.symlink(self.outside, join(self.root, 'link'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_check_permissions_tree(self):
+        usergroup = grp.getgrgid(os.getegid()).gr_name if grp else None
+        i = Installer(batch=True, cfg=SimpleNamespace(usergroup=usergroup))
+        i.check_permissions_tree(self.root, exclude=['env'])
+        self.assertEqual(mode(self.root), DIR_MODE)
+        # directories below the root get only the setgid bit added
+        self.assertEqual(mode(join(self.root, 'media')), 0o2755)
+        self.assertEqual(mode(join(self.root, 'media', 'uploads')), 0o2755)
+        # private files remain private
+        self.assertEqual(mode(self.secret), 0o600)
+        # the excluded virtualenv is not touched
+        self.assertEqual(mode(join(self.root, 'env')), 0o755)
+        self.assertEqual(mode(join(self.root, 'env', 'lib')), 0o755)
+        # symbolic links are not followed
+        self.assertTrue(os.path.islink(join(self.root, 'link')))
+        self.assertEqual(mode(self.outside), 0o755)
+        if usergroup:
+            self.assertEqual(os.stat(self.secret).st_gid, os.getegid())
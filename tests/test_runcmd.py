@@ -0,0 +1,61 @@
+# Copyright 2020 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+import subprocess
+from unittest import mock
+
+import click
+from atelier.test import TestCase
+
+from getlino.utils import Installer
+
+
+class RunCmdTests(TestCase):
+
+    def runcmd(self, cmd, returncode=0):
+        i = Installer(batch=True)
+        with mock.patch('getlino.utils.subprocess.run') as run:
+            run.return_value = subprocess.CompletedProcess(cmd, returncode)
+            i.runcmd(cmd)
+        args, kw = run.call_args
+        return args[0], kw
+
+    def test_shell_syntax(self):
+        for cmd in [
+                "git pull && pip install -e .",
+                "ls | wc -l",
+                "echo foo > bar",
+                "echo $HOME",
+                "rm *.pyc",
+                "ls ?.py",
+                'echo "a b"',
+                "echo 'a b'",
+                "cd ~",
+                "a; b"]:
+            with self.subTest(cmd=cmd):
+                args, kw = self.runcmd(cmd)
+                self.assertEqual(args, cmd)
+                self.assertIs(kw.get('shell'), True)
+
+    def test_plain_command(self):
+        for cmd, expected in [
+                ("git clone -q https://github.com/lino-framework/lino.git lino",
+                 ['git', 'clone', '-q', 'https://github.com/lino-framework/lino.git', 'lino']),
+                ("systemctl restart  supervisor",
+                 ['systemctl', 'restart', 'supervisor'])]:
+            with self.subTest(cmd=cmd):
+                args, kw = self.runcmd(cmd)
+                self.assertEqual(args, expected)
+                self.assertNotIn('shell', kw)
+                # batch mode doesn't wait for answers
+                self.assertIs(kw['stdin'], subprocess.DEVNULL)
+
+    def test_argv(self):
+        # a list is never given to the shell
+        args, kw = self.runcmd(['echo', 'a && b'])
+        self.assertEqual(args, ['echo', 'a && b'])
+        self.assertNotIn('shell', kw)
+
+    def test_returncode(self):
+        with self.assertRaises(click.ClickException):
+            self.runcmd("false", returncode=1)